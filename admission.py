@@ -0,0 +1,157 @@
+"""Admission control for the Chainlit shopping assistant.
+
+Bounds how many queries reach the LLM at once, keeps every chat session to a
+single in-flight query and sheds load up front when the expected queue wait
+would exceed the SLO, so latency degrades gracefully instead of every request
+timing out together.
+"""
+import asyncio
+import itertools
+import math
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class AdmissionRejected(Exception):
+    """Raised when a query is shed instead of being queued."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    """A queued or running query."""
+    ticket_id: int
+    session_id: str
+    enqueued_at: float
+    started_at: Optional[float] = None
+
+
+class AdmissionController:
+    """FIFO admission queue with global and per-session concurrency limits."""
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32,
+                 queue_slo: float = 20.0, initial_service_time: float = 5.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_slo = queue_slo  # Longest acceptable wait before processing starts
+
+        # Exponentially weighted average of how long a query holds a slot
+        self.avg_service_time = initial_service_time
+        self.smoothing = 0.2
+
+        self._queue: List[Ticket] = []
+        self._active_sessions: Dict[str, Ticket] = {}  # Session -> its running ticket
+        self._in_flight = 0
+        self._changed = asyncio.Event()
+        self._ids = itertools.count(1)
+
+        # Counters for the stats command
+        self.admitted = 0
+        self.shed = 0
+
+    def _notify(self):
+        """Wake every waiter so it can re-check its position."""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _runnable(self, ticket: Ticket) -> bool:
+        """A ticket runs when a slot is free and it is the oldest eligible one."""
+        if self._in_flight >= self.max_concurrent:
+            return False
+        for queued in self._queue:
+            if queued.session_id in self._active_sessions:
+                continue  # Session already has a query running
+            return queued is ticket
+        return False
+
+    def _session_busy_for(self, session_id: Optional[str]) -> float:
+        """Expected remaining time of the query a session already has running."""
+        running = self._active_sessions.get(session_id)
+        if running is None or running.started_at is None:
+            return 0.0
+        return max(0.0, self.avg_service_time - (time.monotonic() - running.started_at))
+
+    def estimated_wait(self, ahead: int, session_id: Optional[str] = None) -> float:
+        """Estimate the queue wait for a ticket with `ahead` tickets in front of it.
+
+        A ticket from a session with a query already running also waits for that query.
+        """
+        slots_needed = self._in_flight + ahead + 1 - self.max_concurrent
+        slot_wait = 0.0
+        if slots_needed > 0:
+            slot_wait = math.ceil(slots_needed / self.max_concurrent) * self.avg_service_time
+        return max(slot_wait, self._session_busy_for(session_id))
+
+    def _reject(self, reason: str, retry_after: float):
+        self.shed += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, session_id: str,
+                      on_position: Optional[Callable[[int, float], Awaitable[None]]] = None) -> Ticket:
+        """Wait for a processing slot, reporting queue position changes via `on_position`."""
+        if len(self._queue) >= self.max_queue:
+            self._reject("queue is full", self.estimated_wait(len(self._queue)))
+
+        expected_wait = self.estimated_wait(len(self._queue), session_id)
+        if expected_wait > self.queue_slo:
+            self._reject("expected wait exceeds SLO", expected_wait)
+
+        ticket = Ticket(next(self._ids), session_id, time.monotonic())
+        self._queue.append(ticket)
+        last_position = None
+
+        try:
+            while not self._runnable(ticket):
+                position = self._queue.index(ticket) + 1
+                if on_position and position != last_position:
+                    last_position = position
+                    await on_position(position, self.estimated_wait(position - 1, session_id))
+                    continue  # State may have changed while reporting
+
+                remaining = self.queue_slo - (time.monotonic() - ticket.enqueued_at)
+                if remaining <= 0:
+                    self._reject("queue wait exceeded SLO", self.avg_service_time)
+
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._queue.remove(ticket)
+            self._notify()
+            raise
+
+        self._queue.remove(ticket)
+        self._active_sessions[session_id] = ticket
+        self._in_flight += 1
+        self.admitted += 1
+        ticket.started_at = time.monotonic()
+        self._notify()
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Free the slot held by `ticket` and update the service time estimate."""
+        self._in_flight -= 1
+        if self._active_sessions.get(ticket.session_id) is ticket:
+            del self._active_sessions[ticket.session_id]
+
+        if ticket.started_at is not None:
+            service_time = time.monotonic() - ticket.started_at
+            self.avg_service_time += self.smoothing * (service_time - self.avg_service_time)
+
+        self._notify()
+
+    def get_stats(self) -> str:
+        """Get admission queue statistics."""
+        stats = "**Admission Queue:**\n"
+        stats += f"• In flight: {self._in_flight}/{self.max_concurrent}\n"
+        stats += f"• Queued: {len(self._queue)}/{self.max_queue}\n"
+        stats += f"• Admitted: {self.admitted} | Shed: {self.shed}\n"
+        stats += f"• Avg service time: {self.avg_service_time:.1f}s (queue SLO {self.queue_slo:.0f}s)\n"
+        return stats
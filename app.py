@@ -1,15 +1,49 @@
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 from mcp_use import MCPAgent, MCPClient
 import os
 import asyncio
 import json
-import requests
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import re
+import threading
 import time
 from asyncio import sleep
+from circuit_breaker import CircuitBreakerRegistry
+from llm_gateway import get_gateway
+from mcp_selector import MCPServerSelector
+from product_index import get_product_index
+from profiler import get_profiler, parse_profile_command, profiling_enabled
+from token_budget import CACHE_ONLY, DOWNGRADE, FALLBACK, get_token_ledger
+from request_log import RequestLog, RequestTrace
+
+
+async def async_input(prompt: str) -> str:
+    """Read a line on a daemon thread so the event loop keeps running while we wait."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
+
+    def read():
+        try:
+            line = input(prompt)
+        except BaseException as e:  # EOFError on Ctrl+D
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, line)
+
+    threading.Thread(target=read, name="repl-input", daemon=True).start()
+    return await future
+
+class MCPServerStartError(Exception):
+    """An MCP server failed to start; the failure is already charged to its circuit breaker."""
+
+    def __init__(self, server: str, error: Exception):
+        super().__init__(f"MCP server {server} failed to start: {error}")
+        self.server = server
 
 class ShoppingAssistant:
     """Intelligent AI Shopping Assistant with web search and product comparison capabilities."""
@@ -25,9 +59,15 @@ class ShoppingAssistant:
         # Config file path - update this to your browser MCP config
         self.config_file = r"D:\mcp\mcpdemo\browser_mcp.json"
         
-        # Initialize MCP components
-        self.client = None
-        self.agent = None
+        # Initialize MCP components. Each server is started the first time a query
+        # needs it and its session is then shared by every agent; agents are
+        # created per set of servers and model but share one conversation memory.
+        self.server_selector = None
+        self.llms = {}  # Model name -> shared ChatGroq
+        self.system_prompt = None
+        self.client: Optional[MCPClient] = None
+        self.agents: Dict[Tuple[Tuple[str, ...], str], MCPAgent] = {}
+        self.conversation_memory = []  # Agent messages carried between queries
         self.conversation_context = []
         
         # Rate limiting and error handling
@@ -36,6 +76,22 @@ class ShoppingAssistant:
         self.max_retries = 3
         self.retry_delay = 5
         
+        # Circuit breakers per upstream: the LLM model and each MCP server
+        self.model_name = "qwen-qwq-32b"
+        self.cheap_model_name = "llama-3.1-8b-instant"  # Used once a token budget is nearly spent
+        self.session_id = "cli"
+        self.mcp_servers = []
+        self.circuit_breakers = CircuitBreakerRegistry(
+            failure_threshold=0.5,
+            window_size=10,
+            min_calls=3,
+            open_duration=60.0
+        )
+        
+        # Append-only log of processed queries, replayable with replay.py
+        self.request_log = RequestLog()
+        self.profile_task: Optional[asyncio.Task] = None  # Background `profile` capture, if any
+        
         # Product categories and keywords for better query understanding
         self.product_categories = {
             'electronics': ['phone', 'laptop', 'tablet', 'tv', 'camera', 'headphones', 'speaker'],
@@ -45,6 +101,10 @@ class ShoppingAssistant:
             'home': ['furniture', 'decor', 'bedding', 'kitchen', 'bathroom']
         }
         
+        # Local semantic index of known topics and recent answers
+        self.product_index = get_product_index()
+        self.product_index.seed_topics(self.product_categories)
+        
         # Shopping sites for targeted searches
         self.shopping_sites = [
             'amazon.com', 'flipkart.com', 'ebay.com', 'bestbuy.com', 
@@ -52,21 +112,31 @@ class ShoppingAssistant:
         ]
 
     async def initialize(self):
-        """Initialize the MCP client and agent."""
+        """Load the MCP server profiles and the LLM; agents are created on first use."""
         print("🚀 Initializing Shopping Assistant...")
         
         try:
-            self.client = MCPClient.from_config_file(self.config_file)
-            llm = ChatGroq(
-                model="qwen-qwq-32b",
+            self.server_selector = MCPServerSelector.from_config_file(self.config_file)
+            self.mcp_servers = self.server_selector.server_names()
+            self.client = MCPClient.from_dict(self.server_selector.client_config(self.mcp_servers))
+            # Shared ChatGroq backed by the process-wide pooled HTTP client
+            self.llms[self.model_name] = get_gateway().get_llm(
+                self.model_name,
                 temperature=0.1,  # Very low temperature for stability
                 max_tokens=1500,  # Reduced token limit
                 max_retries=2,    # Built-in retry mechanism
                 request_timeout=30  # Timeout to prevent hanging
             )
+            self.llms[self.cheap_model_name] = get_gateway().get_llm(
+                self.cheap_model_name,
+                temperature=0.1,
+                max_tokens=1000,
+                max_retries=1,
+                request_timeout=20
+            )
             
             # Simplified system prompt to reduce function call complexity
-            shopping_system_prompt = """
+            self.system_prompt = """
             You are a helpful Shopping Assistant. When users ask about products:
             
             1. If they ask for current information, use web search ONCE per query
@@ -82,22 +152,97 @@ class ShoppingAssistant:
             IMPORTANT: Only use tools when absolutely necessary. Prefer using your existing knowledge first.
             """
             
-            self.agent = MCPAgent(
-                llm=llm,
-                client=self.client,
-                max_steps=8,  # Reduced steps to prevent errors
-                memory_enabled=True,
-                system_prompt=shopping_system_prompt
-            )
-            
             print("✅ Shopping Assistant initialized successfully!")
             
         except Exception as e:
             print(f"❌ Error initializing: {e}")
             raise
 
-    async def safe_search_with_retry(self, query: str) -> Optional[str]:
+    async def _get_agent(self, servers: Tuple[str, ...], model_name: str) -> MCPAgent:
+        """Get the agent for a set of MCP servers and a model, starting only servers not already running."""
+        key = (servers, model_name)
+        if key not in self.agents:
+            sessions = self.client.get_all_active_sessions()
+            for name in servers:
+                if name not in sessions:
+                    print(f"🔌 Starting MCP server: {name}")
+                    try:
+                        session = await self.client.create_session(name)
+                        if session is None:
+                            raise RuntimeError("no session was created")
+                    except Exception as e:
+                        # Start-up errors rarely name the server, so blame it here rather than the LLM
+                        self.circuit_breakers.get(f"mcp:{name}").record_failure()
+                        raise MCPServerStartError(name, e) from e
+                    sessions[name] = session
+            self.agents[key] = MCPAgent(
+                llm=self.llms[model_name],
+                connectors=[sessions[name].connector for name in servers],
+                max_steps=8,  # Reduced steps to prevent errors
+                memory_enabled=True,
+                system_prompt=self.system_prompt
+            )
+        return self.agents[key]
+
+    async def _run_agent(self, servers: Tuple[str, ...], model_name: str, prompt: str) -> str:
+        """Run a prompt on the agent for these servers, continuing the shared conversation."""
+        agent = await self._get_agent(servers, model_name)
+        agent.clear_conversation_history()
+        for message in self.conversation_memory:
+            agent.add_to_history(message)
+        try:
+            return await agent.run(prompt)
+        finally:
+            self.conversation_memory = list(agent.get_conversation_history())
+
+    def _blame_servers(self, error_text: str, servers: Tuple[str, ...]) -> List[str]:
+        """Find the MCP servers named in an error message."""
+        error_lower = error_text.lower()
+        return [name for name in servers if name.lower() in error_lower]
+
+    def _record_search_failure(self, error_text: str, servers: Tuple[str, ...], model_name: str):
+        """Charge a failure to the servers it names, or to the LLM otherwise."""
+        blamed = self._blame_servers(error_text, servers)
+        if blamed:
+            for name in blamed:
+                self.circuit_breakers.get(f"mcp:{name}").record_failure()
+        else:
+            self.circuit_breakers.get(f"llm:{model_name}").record_failure()
+
+    def _record_search_success(self, servers: Tuple[str, ...], model_name: str):
+        self.circuit_breakers.get(f"llm:{model_name}").record_success()
+        for name in servers:
+            self.circuit_breakers.get(f"mcp:{name}").record_success()
+
+    def _available_servers(self, analysis: Dict, model_name: str) -> Tuple[str, ...]:
+        """Select MCP servers for a query, skipping any whose circuit is open.
+
+        Returns an empty tuple when the search path is short-circuited.
+        """
+        llm_breaker = self.circuit_breakers.get(f"llm:{model_name}")
+        if not llm_breaker.allow_request():
+            print(f"⚡ Circuit open for {llm_breaker.name}, skipping search")
+            return ()
+        
+        open_servers = [name for name in self.mcp_servers if self.circuit_breakers.get(f"mcp:{name}").is_open()]
+        servers = self.server_selector.select(analysis, exclude=open_servers)
+        if not servers:
+            print("⚡ Circuits open for every suitable MCP server, skipping search")
+        return servers
+
+    async def safe_search_with_retry(self, query: str, trace: Optional[RequestTrace] = None,
+                                     analysis: Optional[Dict] = None, model_name: Optional[str] = None) -> Optional[str]:
         """Perform web search with rate limiting and retry logic."""
+        trace = trace or RequestTrace()
+        analysis = analysis or self.categorize_query(query)
+        model_name = model_name or self.model_name
+        
+        # Fail fast while an upstream is known to be down
+        servers = self._available_servers(analysis, model_name)
+        if not servers:
+            trace.route = "circuit_open"
+            return None
+        
         # Check rate limiting
         current_time = time.time()
         time_since_last_search = current_time - self.last_search_time
@@ -105,9 +250,11 @@ class ShoppingAssistant:
         if time_since_last_search < self.min_search_interval:
             wait_time = self.min_search_interval - time_since_last_search
             print(f"⏳ Rate limiting: waiting {wait_time:.1f} seconds...")
-            await sleep(wait_time)
+            with trace.stage('rate_limit'):
+                await sleep(wait_time)
         
         for attempt in range(self.max_retries):
+            trace.attempts = attempt + 1
             try:
                 print(f"🔍 Searching... (attempt {attempt + 1}/{self.max_retries})")
                 
@@ -117,21 +264,41 @@ class ShoppingAssistant:
                 # Update last search time
                 self.last_search_time = time.time()
                 
-                # Try to get response from agent
-                response = await self.agent.run(search_prompt)
+                # Try to get response from an agent holding only the servers this query needs
+                trace.upstreams = list(servers)
+                with trace.stage('upstream'):
+                    response = await self._run_agent(servers, model_name, search_prompt)
                 
                 if response and "Error" not in response:
+                    self._record_search_success(servers, model_name)
+                    trace.route = "search"
                     return response
                 else:
                     print(f"⚠️ Search attempt {attempt + 1} returned error or empty result")
+                    self._record_search_failure(response or "", servers, model_name)
+                    servers = self._available_servers(analysis, model_name)
+                    if not servers:
+                        trace.route = "circuit_open"
+                        break
                     
             except Exception as e:
                 print(f"⚠️ Search attempt {attempt + 1} failed: {str(e)}")
+                if not isinstance(e, MCPServerStartError):
+                    self._record_search_failure(str(e), servers, model_name)
+                
+                # Stop retrying as soon as the breakers leave nothing to try
+                servers = self._available_servers(analysis, model_name)
+                if not servers:
+                    trace.route = "circuit_open"
+                    break
                 
                 if attempt < self.max_retries - 1:
                     print(f"🔄 Retrying in {self.retry_delay} seconds...")
-                    await sleep(self.retry_delay)
+                    with trace.stage('retry_delay'):
+                        await sleep(self.retry_delay)
         
+        if trace.route != "circuit_open":
+            trace.route = "fallback"
         return None
 
     def get_fallback_response(self, query: str, analysis: Dict) -> str:
@@ -190,11 +357,19 @@ Would you like me to help you with a more specific aspect of your query using my
         
         # Detect product category
         detected_category = 'general'
+        category_source = 'keywords'
         for category, keywords in self.product_categories.items():
             if any(keyword in query_lower for keyword in keywords):
                 detected_category = category
                 break
         
+        # Fall back to the local index for phrasings the keywords don't cover
+        if detected_category == 'general':
+            match = self.product_index.detect_category(query)
+            if match:
+                detected_category = match[0]
+                category_source = 'index'
+        
         # Extract budget if mentioned
         budget_match = re.search(r'\$?(\d+(?:,\d{3})*(?:\.\d{2})?)', query)
         budget = budget_match.group(1) if budget_match else None
@@ -202,6 +377,7 @@ Would you like me to help you with a more specific aspect of your query using my
         return {
             'query_types': [qtype for qtype, detected in query_types.items() if detected],
             'category': detected_category,
+            'category_source': category_source,
             'budget': budget,
             'original_query': query
         }
@@ -227,14 +403,46 @@ Would you like me to help you with a more specific aspect of your query using my
 
     async def process_shopping_query(self, user_query: str) -> str:
         """Process shopping-related queries with enhanced error handling."""
+        trace = RequestTrace()
+        query_analysis = None
         try:
             # Analyze the query
-            query_analysis = self.categorize_query(user_query)
+            with trace.stage('analyze'):
+                query_analysis = self.categorize_query(user_query)
             
             print(f"🔍 Query Analysis: {query_analysis['query_types']} | Category: {query_analysis['category']}")
             
-            # Try to get current information via search
-            search_result = await self.safe_search_with_retry(user_query)
+            # Check token budgets before spending anything on the LLM
+            budget_decision = get_token_ledger().check(self.session_id, query_analysis['category'], self.model_name)
+            
+            # Answer locally when an almost identical query was answered recently. Follow-ups
+            # depend on the conversation so far, so their answers are neither reused nor stored.
+            follow_up = bool(self.conversation_memory)
+            with trace.stage('index'):
+                cached_answer = None if follow_up else self.product_index.lookup_answer(user_query)
+            
+            if cached_answer:
+                print(f"⚡ Answered from local index (similarity {cached_answer[1]:.2f})")
+                trace.cache = "hit"
+                trace.route = "index"
+                search_result = cached_answer[0]
+            elif budget_decision in (CACHE_ONLY, FALLBACK):
+                print("💸 Token budget exhausted, skipping search")
+                trace.cache = "miss"
+                trace.route = "budget_fallback"
+                search_result = None
+            else:
+                trace.cache = "miss"
+                model_name = self.cheap_model_name if budget_decision == DOWNGRADE else self.model_name
+                
+                # Try to get current information via search
+                with trace.stage('search'), get_token_ledger().scope(self.session_id, query_analysis['category']) as usage:
+                    search_result = await self.safe_search_with_retry(user_query, trace, query_analysis, model_name)
+                trace.tokens = usage.tokens
+                
+                if search_result:
+                    self.product_index.add(user_query, query_analysis['category'],
+                                           answer=None if follow_up else search_result)
             
             if search_result:
                 print("✅ Successfully retrieved current information")
@@ -252,12 +460,16 @@ Would you like me to help you with a more specific aspect of your query using my
                 'search_successful': search_result is not None
             })
             
+            self.request_log.record("cli", user_query, query_analysis, trace)
             return response
             
         except Exception as e:
             error_msg = f"❌ Error processing query: {str(e)}"
             print(error_msg)
             
+            trace.route = "error"
+            self.request_log.record("cli", user_query, query_analysis, trace)
+            
             # Provide helpful fallback
             return f"""
 {error_msg}
@@ -300,11 +512,13 @@ Would you like to try a different question?
         print("• Type 'clear' to clear conversation history")
         print("• Type 'context' to see conversation summary")
         print("• Type 'status' to check system status")
+        if profiling_enabled():
+            print("• Type 'profile 30s' to capture an event-loop profile")
         print("="*60 + "\n")
         
         try:
             while True:
-                user_input = input("\n🛒 You: ").strip()
+                user_input = (await async_input("\n🛒 You: ")).strip()
                 
                 if not user_input:
                     continue
@@ -314,7 +528,9 @@ Would you like to try a different question?
                     break
                 
                 if user_input.lower() == "clear":
-                    self.agent.clear_conversation_history()
+                    for agent in self.agents.values():
+                        agent.clear_conversation_history()
+                    self.conversation_memory.clear()
                     self.conversation_context.clear()
                     print("🧹 Conversation history cleared.")
                     continue
@@ -329,6 +545,21 @@ Would you like to try a different question?
                     print(f"• Last search: {last_search_ago:.1f} seconds ago")
                     print(f"• Rate limit interval: {self.min_search_interval} seconds")
                     print(f"• Conversations stored: {len(self.conversation_context)}")
+                    running = list(self.client.get_all_active_sessions()) if self.client else []
+                    print(f"• Running MCP servers: {', '.join(running) or 'none yet'}")
+                    print(f"• Circuit breakers:\n{self.circuit_breakers.get_status()}")
+                    print(get_gateway().get_stats())
+                    print(get_token_ledger().get_stats())
+                    continue
+                
+                profile_duration = parse_profile_command(user_input) if profiling_enabled() else None
+                if profile_duration is not None:
+                    if get_profiler().running:
+                        print("🔬 A profile is already being captured.")
+                    else:
+                        # Runs alongside the queries typed in the meantime
+                        self.profile_task = asyncio.create_task(self.capture_profile(profile_duration))
+                        print(f"🔬 Profiling the event loop for {profile_duration:.0f}s. Keep chatting to profile real queries.")
                     continue
                 
                 print("\n🤖 Assistant: ", end="", flush=True)
@@ -346,17 +577,29 @@ Would you like to try a different question?
                     print(f"❌ Unexpected error: {str(e)}")
                     print("🔄 Please try a simpler question or check your internet connection.")
         
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
             print("\n\n👋 Shopping Assistant interrupted. Goodbye!")
         
         finally:
             await self.cleanup()
 
+    async def capture_profile(self, duration: float):
+        """Capture a profile in the background and print its summary."""
+        try:
+            report = await get_profiler().capture(duration)
+            print(f"\n\n🔬 {report.summary}")
+        except Exception as e:
+            print(f"\n❌ Profile capture failed: {e}")
+
     async def cleanup(self):
         """Clean up resources."""
+        if self.profile_task and not self.profile_task.done():
+            self.profile_task.cancel()
+        self.request_log.close()
+        await get_gateway().aclose()
         if self.client and self.client.sessions:
             await self.client.close_all_sessions()
-            print("🧹 Resources cleaned up.")
+        print("🧹 Resources cleaned up.")
 
 async def main():
     """Main function to run the shopping assistant."""
@@ -381,4 +624,7 @@ if __name__ == "__main__":
     print("• 'Best laptop for programming under $1000'")
     print("• 'Sony WH-1000XM5 vs Bose QuietComfort 45 headphones'")
     
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass  # Already said goodbye
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""Circuit breakers for the upstreams the shopping assistants depend on.
+
+Each upstream (an LLM model or an MCP server) gets its own breaker. After
+enough recent calls fail the breaker opens and callers skip straight to their
+fallback; once the cool-down expires a limited number of probe requests are
+let through to decide whether to close it again.
+"""
+import time
+from collections import deque
+from typing import Dict
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by a rolling failure rate."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: float = 0.5, window_size: int = 10,
+                 min_calls: int = 3, open_duration: float = 30.0, half_open_probes: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold  # Failure rate that trips the breaker
+        self.min_calls = min_calls  # Calls needed in the window before the rate counts
+        self.open_duration = open_duration  # Seconds to stay open before probing
+        self.half_open_probes = half_open_probes
+
+        self._results = deque(maxlen=window_size)  # True for success, False for failure
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_started = []
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        """Current state, moving from open to half-open once the cool-down expires."""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._state = self.HALF_OPEN
+            self._probes_started = []
+        return self._state
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._results:
+            return 0.0
+        return self._results.count(False) / len(self._results)
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will allow a probe."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.open_duration - (time.monotonic() - self._opened_at))
+
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def allow_request(self) -> bool:
+        """Check whether a call may go through, reserving a probe slot when half-open."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+
+        # Forget probes that never reported back (e.g. cancelled requests)
+        now = time.monotonic()
+        self._probes_started = [t for t in self._probes_started if now - t < self.open_duration]
+        if len(self._probes_started) < self.half_open_probes:
+            self._probes_started.append(now)
+            return True
+        return False
+
+    def record_success(self):
+        if self.state == self.HALF_OPEN:
+            self._close()
+        else:
+            self._results.append(True)
+
+    def record_failure(self):
+        state = self.state
+        if state == self.HALF_OPEN:
+            self._open()
+            return
+
+        self._results.append(False)
+        if (state == self.CLOSED and len(self._results) >= self.min_calls
+                and self.failure_rate >= self.failure_threshold):
+            self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes_started = []
+        self.times_opened += 1
+        print(f"⚡ Circuit opened for {self.name} (failure rate {self.failure_rate:.0%})")
+
+    def _close(self):
+        self._state = self.CLOSED
+        self._results.clear()
+        self._probes_started = []
+        print(f"✅ Circuit closed for {self.name}")
+
+    def describe(self) -> str:
+        state = self.state
+        summary = f"{self.name}: {state} (failure rate {self.failure_rate:.0%}, opened {self.times_opened}x)"
+        if state == self.OPEN:
+            summary += f", probing in {self.retry_after():.0f}s"
+        return summary
+
+
+class CircuitBreakerRegistry:
+    """Creates and holds one breaker per upstream name."""
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(name, **self.breaker_options)
+        return self._breakers[name]
+
+    def get_status(self) -> str:
+        """One line per known upstream, for the status command."""
+        if not self._breakers:
+            return "No upstream calls yet."
+        return "\n".join(f"• {breaker.describe()}" for breaker in self._breakers.values())
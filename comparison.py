@@ -0,0 +1,40 @@
+"""Parsing of product comparison queries.
+
+Kept free of third-party imports so it can be used and tested without the
+Chainlit or LangChain stack.
+"""
+import re
+from typing import List
+
+
+def extract_compared_products(query: str, max_products: int = 4) -> List[str]:
+    """Pull the compared products out of a comparison query, or [] if it doesn't name them clearly.
+
+    Only "vs"/"versus" separate products on their own; "and", "or" and commas do
+    too once a comparison prefix such as "compare" or "difference between" was found.
+    """
+    explicit = re.search(r'\s(?:vs\.?|versus)\s', query, flags=re.IGNORECASE)
+    # A "for <use case>" right after "which is better" is a qualifier, not a product
+    cleaned, prefixed = re.subn(
+        r'^\s*(?:compare|comparison (?:of|between)|which (?:one )?is better(?:\s+for\s+[^,:]+)?[,:]?|'
+        r'(?:which )?should i (?:buy|get)[,:]?|(?:what(?:\'s| is| are) the )?differences? between|'
+        r'what(?:\'s| is| are) the features? of)\s+',
+        '', query, flags=re.IGNORECASE)
+    if not explicit and not prefixed:
+        return []
+    
+    # Drop trailing qualifiers such as "in terms of price" or "camera comparison"
+    cleaned = re.sub(r'\s+(?:in terms of|when it comes to|for)\s+.*$', '', cleaned, flags=re.IGNORECASE)
+    cleaned = re.sub(r'\W*\s+(?:comparison|which is better|which one is better)\W*$', '', cleaned, flags=re.IGNORECASE)
+    separators = r'\s+(?:vs\.?|versus|or|and)\s+|,\s*' if prefixed else r'\s+(?:vs\.?|versus)\s+'
+    parts = re.split(separators, cleaned, flags=re.IGNORECASE)
+    products = [re.sub(r'^(?:the|a|an)\s+', '', part.strip(' ?!.,:;'), flags=re.IGNORECASE) for part in parts]
+    products = [product for product in products if product]
+    
+    # A part that still reads like a question means this wasn't a product list
+    question_words = r'\b(?:what|which|who|why|how|where|when|is|are|does|do|should|can|could|would|will)\b'
+    if any(re.search(question_words, product, flags=re.IGNORECASE) for product in products):
+        return []
+    if len(products) < 2 or len(products) > max_products:
+        return []
+    return products
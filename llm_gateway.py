@@ -0,0 +1,126 @@
+"""Process-wide LLM gateway shared by both shopping assistants.
+
+Owns a single pooled, keep-alive HTTP client (HTTP/2 when `h2` is installed)
+and hands out cached ChatGroq instances built on top of it, so every chat
+session reuses warm connections instead of paying a fresh TLS handshake.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_groq import ChatGroq
+
+from token_budget import get_token_ledger
+
+try:
+    import h2  # noqa: F401 - HTTP/2 support comes from `pip install httpx[http2]`
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMGateway:
+    """Shares one connection pool and one ChatGroq per model configuration."""
+
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 120.0, connect_timeout: float = 10.0,
+                 request_timeout: float = 30.0, http2: bool = True, force_request_timeout: bool = False):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        # When set, request_timeout also replaces the timeouts callers ask for per model
+        self.force_request_timeout = force_request_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._models: Dict[Tuple, ChatGroq] = {}
+
+        # Connection reuse metrics
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                ),
+                timeout=httpx.Timeout(self.request_timeout, connect=self.connect_timeout),
+                event_hooks={'request': [self._on_request]}
+            )
+        return self._http_client
+
+    async def _on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions['trace'] = self._on_trace
+
+    async def _on_trace(self, event_name: str, info: Dict):
+        # These events only fire when the pool has to open a new connection
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def get_llm(self, model: str, temperature: float = 0.1, max_tokens: int = 1500,
+                max_retries: int = 2, request_timeout: Optional[float] = None) -> ChatGroq:
+        """Get the shared ChatGroq for a model configuration, creating it on first use."""
+        timeout = self.request_timeout if self.force_request_timeout or not request_timeout else request_timeout
+        key = (model, temperature, max_tokens, max_retries, timeout)
+        if key not in self._models:
+            self._models[key] = ChatGroq(
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                max_retries=max_retries,
+                request_timeout=timeout,
+                api_key=os.getenv("GROQ_API_KEY"),
+                http_async_client=self._get_http_client(),
+                callbacks=[get_token_ledger().handler]  # Token and latency accounting
+            )
+        return self._models[key]
+
+    @property
+    def reused_connections(self) -> int:
+        return max(0, self.requests - self.new_connections)
+
+    def get_stats(self) -> str:
+        """Get connection pool statistics."""
+        reuse_rate = self.reused_connections / self.requests if self.requests else 0.0
+        stats = "**LLM Connection Pool:**\n"
+        stats += f"• Protocol: {'HTTP/2' if self.http2 else 'HTTP/1.1'} | Pool size: {self.max_connections}\n"
+        stats += f"• Requests: {self.requests} | New connections: {self.new_connections} | TLS handshakes: {self.tls_handshakes}\n"
+        stats += f"• Connection reuse: {reuse_rate:.0%}\n"
+        return stats
+
+    async def aclose(self):
+        """Close the pooled HTTP client."""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            self._models.clear()
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_gateway() -> LLMGateway:
+    """Get the process-wide gateway, configured from the environment on first use.
+
+    LLM_REQUEST_TIMEOUT, when set, overrides the timeout of every model.
+    """
+    global _gateway
+    if _gateway is None:
+        request_timeout = os.getenv("LLM_REQUEST_TIMEOUT")
+        _gateway = LLMGateway(
+            max_connections=int(os.getenv("LLM_POOL_SIZE", "20")),
+            max_keepalive_connections=int(os.getenv("LLM_POOL_KEEPALIVE", "10")),
+            request_timeout=float(request_timeout or "30"),
+            force_request_timeout=bool(request_timeout)
+        )
+    return _gateway
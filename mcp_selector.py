@@ -0,0 +1,112 @@
+"""Per-query MCP server selection.
+
+`browser_mcp.json` describes each server's `capabilities` and relative `cost`.
+The selector maps a query analysis from `categorize_query` to the
+capabilities it needs and picks the cheapest set of servers covering them, so
+only those servers are started and only their tool schemas reach the agent
+prompt. With a handful of servers every combination is checked, so the set is
+the true minimum-cost cover.
+"""
+import itertools
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Keys in a server entry that describe it to the selector rather than to MCP
+PROFILE_KEYS = ('capabilities', 'cost')
+
+# Above this many useful servers, fall back to a greedy cover instead of trying every subset
+EXACT_COVER_LIMIT = 12
+
+
+@dataclass
+class MCPServerProfile:
+    """A configured MCP server and what it is good for."""
+    name: str
+    config: Dict
+    capabilities: Set[str] = field(default_factory=set)
+    cost: float = 1.0
+
+
+class MCPServerSelector:
+    """Chooses the cheapest set of MCP servers that covers a query's needs."""
+
+    def __init__(self, config: Dict):
+        self.servers: Dict[str, MCPServerProfile] = {}
+        for name, server_config in config.get('mcpServers', {}).items():
+            self.servers[name] = MCPServerProfile(
+                name=name,
+                config={key: value for key, value in server_config.items() if key not in PROFILE_KEYS},
+                # Servers without a profile are treated as general web search tools
+                capabilities=set(server_config.get('capabilities', ['web_search'])),
+                cost=float(server_config.get('cost', 1.0))
+            )
+
+        # Capabilities needed beyond plain web search
+        self.query_type_capabilities = {
+            'price': {'page_content'},  # Live prices need the retailer pages themselves
+        }
+        self.category_capabilities = {
+            'travel': {'lodging'},
+        }
+
+    @classmethod
+    def from_config_file(cls, path: str) -> "MCPServerSelector":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def server_names(self) -> List[str]:
+        return list(self.servers)
+
+    def required_capabilities(self, analysis: Dict) -> Set[str]:
+        """Capabilities a query needs, based on its category and query types."""
+        required = {'web_search'}
+        for query_type in analysis.get('query_types', []):
+            required |= self.query_type_capabilities.get(query_type, set())
+        required |= self.category_capabilities.get(analysis.get('category'), set())
+        return required
+
+    def select(self, analysis: Dict, exclude: Iterable[str] = ()) -> Tuple[str, ...]:
+        """Pick the cheapest set of servers covering a query's capabilities.
+
+        If no set covers everything, the cheapest set covering the most capabilities is used.
+        """
+        excluded = set(exclude)
+        required = self.required_capabilities(analysis)
+        useful = [server for server in self.servers.values()
+                  if server.name not in excluded and server.capabilities & required]
+        if len(useful) > EXACT_COVER_LIMIT:
+            return self._greedy_cover(useful, required)
+
+        best, best_rank = (), None
+        for size in range(len(useful) + 1):
+            for subset in itertools.combinations(useful, size):
+                covered = set().union(*(server.capabilities for server in subset)) & required
+                # Most capabilities covered, then lowest cost, then fewest servers
+                rank = (-len(covered), sum(server.cost for server in subset), size)
+                if best_rank is None or rank < best_rank:
+                    best, best_rank = subset, rank
+
+        return tuple(sorted(server.name for server in best))
+
+    @staticmethod
+    def _greedy_cover(candidates: List[MCPServerProfile], required: Set[str]) -> Tuple[str, ...]:
+        """Approximate cover for large configs: repeatedly take the lowest cost per new capability."""
+        candidates = list(candidates)
+        missing = set(required)
+        selected = []
+
+        while missing:
+            useful = [server for server in candidates if server.capabilities & missing]
+            if not useful:
+                break  # Nothing left can cover the rest; make do with what we have
+            best = min(useful, key=lambda server: server.cost / len(server.capabilities & missing))
+            selected.append(best.name)
+            missing -= best.capabilities
+            candidates.remove(best)
+
+        return tuple(sorted(selected))
+
+    def client_config(self, server_names: Iterable[str]) -> Dict:
+        """Build an MCPClient config containing only the given servers."""
+        return {'mcpServers': {name: self.servers[name].config for name in server_names}}
@@ -0,0 +1,363 @@
+"""Local product/topic index for answering the long tail without a live search.
+
+Queries are embedded on the CPU with a hashing embedder (words and character
+trigrams hashed into a fixed-size vector), so no model download is needed.
+Vectors live in a memory-mapped float32 file next to a JSON-lines file of
+entries, and lookups go through random-hyperplane LSH buckets so only a small
+candidate set is scored exactly, over only the query's non-zero dimensions.
+The results of recent searches are reused, so detecting a query's category and
+looking up its answer cost one search. Answers stay on disk and are read back only
+when a lookup hits, and appends take a file lock so both assistants can share
+one index directory.
+
+The index is seeded with the keyword categories and grows with every answer
+the assistants retrieve, which lets `categorize_query` place unfamiliar
+phrasings and lets repeated questions be answered locally.
+"""
+import array
+import json
+import math
+import mmap
+import operator
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from request_log import read_request_log
+
+DIMENSIONS = 256
+PLANES_PER_TABLE = 8
+TABLES = 8
+SEED = 1729
+EXACT_SEARCH_LIMIT = 256  # Below this many rows a full scan is as cheap as LSH
+SEARCH_K = 5  # Results kept per search; enough for every caller
+SEARCH_CACHE_SIZE = 64
+
+# Shopping filler words that say nothing about the product itself
+STOPWORDS = {
+    'a', 'an', 'and', 'the', 'for', 'of', 'to', 'in', 'on', 'with', 'is', 'are', 'me', 'my', 'i',
+    'what', 'which', 'tell', 'about', 'best', 'good', 'top', 'vs', 'versus', 'compare', 'comparison',
+    'between', 'or', 'should', 'buy', 'recommend', 'suggest', 'please'
+}
+
+
+def embed(text: str, dimensions: int = DIMENSIONS) -> array.array:
+    """Embed text as an L2-normalised vector of hashed word and trigram features."""
+    vector = [0.0] * dimensions
+    words = [word for word in re.findall(r"[a-z0-9+$]+", text.lower()) if word not in STOPWORDS]
+
+    for word in words:
+        features = [(word, 1.0)]
+        padded = f"#{word}#"
+        features += [(padded[i:i + 3], 0.4) for i in range(len(padded) - 2)]
+        for feature, weight in features:
+            digest = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % dimensions] += sign * weight
+
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm:
+        vector = [value / norm for value in vector]
+    return array.array('f', vector)
+
+
+def cosine(a, b) -> float:
+    """Dot product of two normalised vectors."""
+    return sum(map(operator.mul, a, b))
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on `path` across processes."""
+    with open(path, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ProductIndex:
+    """Memory-mapped vector index with LSH buckets for approximate nearest neighbours."""
+
+    def __init__(self, directory: str, dimensions: int = DIMENSIONS):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.entries_path = os.path.join(directory, "entries.jsonl")
+        self.lock_path = os.path.join(directory, "index.lock")
+
+        rng = random.Random(SEED)
+        self._planes = [
+            [array.array('f', (rng.gauss(0, 1) for _ in range(dimensions))) for _ in range(PLANES_PER_TABLE)]
+            for _ in range(TABLES)
+        ]
+
+        # Entry metadata only; answers are read from entries.jsonl at `offset` when needed
+        self.entries: List[Dict] = []
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(TABLES)]
+        self._entries_size = 0  # Bytes of entries.jsonl already read
+        self._searches: "OrderedDict[str, List[Tuple[float, Dict]]]" = OrderedDict()  # Cleared when entries change
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._mapped_rows = 0
+
+        # Thresholds for local answers and category detection
+        self.answer_threshold = 0.92
+        self.category_threshold = 0.55
+        self.answer_max_age = 24 * 3600  # Prices move; don't reuse day-old answers
+
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(self.lock_path):
+            self._sync()
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _clear(self):
+        self.close()
+        self.entries = []
+        self._buckets = [{} for _ in range(TABLES)]
+        self._entries_size = 0
+        self._searches.clear()
+
+    def _sync(self):
+        """Read entries appended since the last sync, by this or another process.
+
+        Must be called with the lock held. Writers append each vector before its
+        entry under the lock, so anything else means an interrupted write and the
+        index is started afresh.
+        """
+        entries_size = self._file_size(self.entries_path)
+        if entries_size < self._entries_size:
+            self._clear()  # Another process started a fresh index
+
+        consistent = True
+        if entries_size > self._entries_size:
+            with open(self.entries_path, "rb") as f:
+                f.seek(self._entries_size)
+                data = f.read()
+            *lines, partial = data.split(b"\n")
+            consistent = not partial.strip()
+            offset = self._entries_size
+            for line in lines:
+                if consistent and line.strip():
+                    try:
+                        self._add_entry(json.loads(line), offset)
+                    except ValueError:
+                        consistent = False
+                offset += len(line) + 1
+            self._entries_size = entries_size
+
+        if not consistent or self._file_size(self.vectors_path) != len(self.entries) * self.dimensions * 4:
+            print("⚠️ Product index is inconsistent, starting a fresh one")
+            self._clear()  # Unmap first; Windows can't delete a mapped file
+            for path in (self.vectors_path, self.entries_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _add_entry(self, entry: Dict, offset: int):
+        self._searches.clear()
+        row = len(self.entries)
+        self.entries.append({
+            'text': entry['text'],
+            'category': entry['category'],
+            'ts': entry['ts'],
+            'has_answer': bool(entry.get('answer')),
+            'offset': offset
+        })
+        for table, signature in enumerate(entry['sig']):
+            self._buckets[table].setdefault(signature, []).append(row)
+
+    def _refresh(self):
+        """Pick up entries other processes have added."""
+        if self._file_size(self.entries_path) != self._entries_size:
+            with _file_lock(self.lock_path):
+                self._sync()
+
+    def _signatures(self, vector) -> List[int]:
+        signatures = []
+        for planes in self._planes:
+            signature = 0
+            for bit, plane in enumerate(planes):
+                if cosine(vector, plane) >= 0:
+                    signature |= 1 << bit
+            signatures.append(signature)
+        return signatures
+
+    def _remap(self):
+        """Map the vector file again after rows were appended."""
+        if self._mapped_rows == len(self.entries):
+            return
+        self.close()
+        if not self.entries:
+            return
+        with open(self.vectors_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap).cast('f')
+        self._mapped_rows = len(self.entries)
+
+    def _candidates(self, signatures: List[int]) -> set:
+        """Rows sharing a bucket with the query, probing one-bit neighbours too."""
+        rows = set()
+        for table, signature in enumerate(signatures):
+            buckets = self._buckets[table]
+            rows.update(buckets.get(signature, ()))
+            for bit in range(PLANES_PER_TABLE):
+                rows.update(buckets.get(signature ^ (1 << bit), ()))
+        return rows
+
+    def search(self, text: str, k: int = 3) -> List[Tuple[float, Dict]]:
+        """Find the k most similar entries to `text` (at most SEARCH_K)."""
+        self._refresh()
+        if not self.entries:
+            return []
+
+        results = self._searches.get(text)
+        if results is None:
+            results = self._search(text)
+            self._searches[text] = results
+            if len(self._searches) > SEARCH_CACHE_SIZE:
+                self._searches.popitem(last=False)
+        else:
+            self._searches.move_to_end(text)
+        return results[:k]
+
+    def _search(self, text: str) -> List[Tuple[float, Dict]]:
+        self._remap()
+        vector = embed(text, self.dimensions)
+        if len(self.entries) <= EXACT_SEARCH_LIMIT:
+            rows = range(len(self.entries))
+        else:
+            rows = self._candidates(self._signatures(vector))
+
+        # Query vectors are sparse, so only their non-zero dimensions contribute to the dot product
+        terms = [(dimension, value) for dimension, value in enumerate(vector) if value]
+        view, width = self._view, self.dimensions
+        scored = []
+        for row in rows:
+            start = row * width
+            scored.append((sum(view[start + dimension] * value for dimension, value in terms), self.entries[row]))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored[:SEARCH_K]
+
+    def add(self, text: str, category: str, answer: Optional[str] = None):
+        """Add a topic (and optionally the answer retrieved for it) to the index."""
+        vector = embed(text, self.dimensions)
+        entry = {
+            'text': text,
+            'category': category,
+            'answer': answer,
+            'ts': round(time.time(), 3),
+            'sig': self._signatures(vector)
+        }
+        line = (json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+        with _file_lock(self.lock_path):
+            # Catch up first so this vector's row is the next one in the file
+            self._sync()
+            with open(self.vectors_path, "ab") as f:
+                f.write(vector.tobytes())
+            with open(self.entries_path, "ab") as f:
+                f.write(line)
+            self._add_entry(entry, self._entries_size)
+            self._entries_size += len(line)
+
+    def seed_topics(self, product_categories: Dict[str, List[str]]):
+        """Seed an empty index with the keyword categories."""
+        if self.entries:
+            return
+        for category, keywords in product_categories.items():
+            for keyword in keywords:
+                self.add(keyword, category)
+
+    def index_request_log(self, path: str) -> int:
+        """Add the categorised queries of a request log as topics."""
+        added = 0
+        for record in read_request_log(path):
+            category = record.get('analysis', {}).get('category')
+            if record.get('query') and category and category != 'general':
+                self.add(record['query'], category)
+                added += 1
+        return added
+
+    def detect_category(self, text: str) -> Optional[Tuple[str, float]]:
+        """Category of the nearest known topic, if it is close enough."""
+        for score, entry in self.search(text, k=1):
+            if score >= self.category_threshold and entry['category'] != 'general':
+                return entry['category'], score
+        return None
+
+    def lookup_answer(self, text: str) -> Optional[Tuple[str, float]]:
+        """A recent stored answer to an almost identical query, if any."""
+        now = time.time()
+        for score, entry in self.search(text, k=5):
+            if score < self.answer_threshold:
+                break
+            if entry['has_answer'] and now - entry['ts'] <= self.answer_max_age:
+                answer = self._read_answer(entry)
+                if answer:
+                    return answer, score
+        return None
+
+    def _read_answer(self, entry: Dict) -> Optional[str]:
+        """Read an entry's answer from disk; None if another process reset the index meanwhile."""
+        try:
+            with open(self.entries_path, "rb") as f:
+                f.seek(entry['offset'])
+                return json.loads(f.readline()).get('answer')
+        except (OSError, ValueError):
+            return None
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._mapped_rows = 0
+
+
+_product_index: Optional[ProductIndex] = None
+
+
+def get_product_index() -> ProductIndex:
+    """Get the process-wide product index stored in PRODUCT_INDEX_DIR."""
+    global _product_index
+    if _product_index is None:
+        _product_index = ProductIndex(os.getenv("PRODUCT_INDEX_DIR", "product_index"))
+    return _product_index
+
+
+if __name__ == "__main__":
+    # Usage: python product_index.py request_log.jsonl
+    if len(sys.argv) != 2:
+        print("Usage: python product_index.py <request_log.jsonl>")
+        sys.exit(1)
+    added = get_product_index().index_request_log(sys.argv[1])
+    print(f"✅ Indexed {added} categorised queries into {get_product_index().directory}")
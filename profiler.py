@@ -0,0 +1,229 @@
+"""Opt-in, low-overhead profiling of a live assistant's event loop.
+
+`profile 30s` starts a capture that runs alongside normal traffic:
+
+* a sampling profiler on a background thread reads the event-loop thread's
+  stack every few milliseconds (no tracing hooks, so the loop runs at full
+  speed);
+* a lag monitor on the loop measures how late its timer wakes up, and when the
+  loop was blocked it records the stack that was running at the time as a
+  slow callback;
+* garbage-collection pauses are timed through `gc.callbacks`.
+
+Results are written as a speedscope file (open at https://www.speedscope.app)
+and a plain-text summary. Set ENABLE_PROFILING=1 to allow the command.
+"""
+import asyncio
+import gc
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+MAX_DURATION = 300.0
+
+Stack = Tuple[int, ...]  # Frame indices from root to leaf
+
+
+def profiling_enabled() -> bool:
+    return os.getenv("ENABLE_PROFILING", "").lower() in ("1", "true", "yes")
+
+
+def parse_profile_command(text: str) -> Optional[float]:
+    """Parse `profile`, `profile 30`, `profile 30s` or `profile 2m` into seconds."""
+    match = re.fullmatch(r"\s*profile(?:\s+(\d+(?:\.\d+)?)\s*(s|sec|m|min)?)?\s*", text.lower())
+    if not match:
+        return None
+    amount = float(match.group(1) or 30)
+    if match.group(2) in ("m", "min"):
+        amount *= 60
+    return min(max(amount, 1.0), MAX_DURATION)
+
+
+@dataclass
+class ProfileReport:
+    """Where a capture was written and its headline numbers."""
+    speedscope_path: str
+    summary_path: str
+    summary: str
+    samples: int = 0
+    slow_callbacks: List[Tuple[float, str]] = field(default_factory=list)
+
+
+class LoopProfiler:
+    """Samples the event-loop thread and watches loop lag and GC pauses."""
+
+    def __init__(self, output_dir: str = "profiles", sample_interval: float = 0.005,
+                 lag_interval: float = 0.05, slow_threshold: float = 0.1):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.lag_interval = lag_interval
+        self.slow_threshold = slow_threshold  # Loop blocked at least this long counts as a slow callback
+        self.running = False
+
+        self._frames: List[Dict] = []
+        self._frame_ids: Dict[Tuple[str, str, int], int] = {}
+        self._samples: List[Stack] = []
+        self._weights: List[float] = []
+        self._recent: Deque[Tuple[float, Stack]] = deque(maxlen=512)
+        self._lags: List[float] = []
+        self._slow: List[Tuple[float, Stack]] = []
+        self._gc_pauses: List[float] = []
+        self._gc_started = 0.0
+
+    def _reset(self):
+        self._frames, self._frame_ids = [], {}
+        self._samples, self._weights = [], []
+        self._recent.clear()
+        self._lags, self._slow, self._gc_pauses = [], [], []
+
+    def _frame_id(self, code, line: int) -> int:
+        key = (code.co_filename, code.co_name, line)
+        frame_id = self._frame_ids.get(key)
+        if frame_id is None:
+            frame_id = len(self._frames)
+            self._frame_ids[key] = frame_id
+            self._frames.append({'name': code.co_name, 'file': code.co_filename, 'line': line})
+        return frame_id
+
+    def _sample_loop(self, thread_id: int, stop: threading.Event):
+        """Runs on the sampler thread until `stop` is set."""
+        last = time.perf_counter()
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+
+            self._samples.append(stack)
+            self._weights.append(now - last)
+            self._recent.append((now, stack))
+            last = now
+
+    async def _watch_lag(self, stop: asyncio.Event):
+        """Measure how late the loop wakes up; long delays mean something blocked it."""
+        while not stop.is_set():
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            woke = time.perf_counter()
+            lag = max(0.0, woke - expected)
+            self._lags.append(lag)
+
+            if lag >= self.slow_threshold:
+                blocked = Counter(stack for ts, stack in list(self._recent) if expected <= ts <= woke)
+                if blocked:
+                    self._slow.append((lag, blocked.most_common(1)[0][0]))
+
+    def _on_gc(self, phase: str, info: Dict):
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        elif self._gc_started:
+            self._gc_pauses.append(time.perf_counter() - self._gc_started)
+            self._gc_started = 0.0
+
+    async def capture(self, duration: float) -> ProfileReport:
+        """Profile the running event loop for `duration` seconds and write the results."""
+        if self.running:
+            raise RuntimeError("A profile capture is already running")
+        self.running = True
+        self._reset()
+
+        thread_stop = threading.Event()
+        lag_stop = asyncio.Event()
+        sampler = threading.Thread(target=self._sample_loop, args=(threading.get_ident(), thread_stop),
+                                   name="loop-profiler", daemon=True)
+        gc.callbacks.append(self._on_gc)
+        started = time.time()
+        try:
+            sampler.start()
+            lag_task = asyncio.create_task(self._watch_lag(lag_stop))
+            await asyncio.sleep(duration)
+        finally:
+            thread_stop.set()
+            lag_stop.set()
+            gc.callbacks.remove(self._on_gc)
+            self.running = False
+
+        await lag_task
+        await asyncio.to_thread(sampler.join)
+        return await asyncio.to_thread(self._write_report, started, time.time() - started)
+
+    def _describe(self, stack: Stack, depth: int = 4) -> str:
+        frames = [self._frames[frame_id] for frame_id in stack[-depth:]]
+        return " <- ".join(f"{frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})"
+                           for frame in reversed(frames))
+
+    def _write_report(self, started: float, elapsed: float) -> ProfileReport:
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+        base = os.path.join(self.output_dir, f"profile-{stamp}")
+
+        speedscope = {
+            '$schema': "https://www.speedscope.app/file-format-schema.json",
+            'name': f"Shopping assistant event loop {stamp}",
+            'exporter': "profiler.py",
+            'shared': {'frames': self._frames},
+            'profiles': [{
+                'type': "sampled",
+                'name': "event loop thread",
+                'unit': "seconds",
+                'startValue': 0,
+                'endValue': sum(self._weights),
+                'samples': [list(stack) for stack in self._samples],
+                'weights': self._weights
+            }]
+        }
+        with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(speedscope, f, separators=(",", ":"))
+
+        # Leaf frames with the most samples are where the loop thread spends its time
+        self_time = Counter()
+        for stack, weight in zip(self._samples, self._weights):
+            if stack:
+                self_time[stack[-1]] += weight
+
+        lags = sorted(self._lags)
+        slow = sorted(self._slow, key=lambda item: item[0], reverse=True)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+
+        summary = f"**Profile ({elapsed:.0f}s, {len(self._samples)} samples):**\n"
+        summary += (f"• Event-loop lag: max {max(lags, default=0) * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms, "
+                    f"{len(slow)} stalls over {self.slow_threshold * 1000:.0f}ms\n")
+        summary += f"• GC pauses: {len(self._gc_pauses)}, total {sum(self._gc_pauses) * 1000:.0f}ms, " \
+                   f"max {max(self._gc_pauses, default=0) * 1000:.0f}ms\n"
+        summary += "• Slowest callbacks:\n"
+        for lag, stack in slow[:5]:
+            summary += f"  - {lag * 1000:.0f}ms in {self._describe(stack)}\n"
+        summary += "• Hottest frames:\n"
+        for frame_id, seconds in self_time.most_common(5):
+            frame = self._frames[frame_id]
+            summary += f"  - {seconds:.2f}s {frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})\n"
+        summary += f"• Flame graph: {base}.speedscope.json\n"
+
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(summary)
+
+        return ProfileReport(base + ".speedscope.json", base + ".txt", summary,
+                             len(self._samples), [(lag, self._describe(stack)) for lag, stack in slow])
+
+
+_profiler: Optional[LoopProfiler] = None
+
+
+def get_profiler() -> LoopProfiler:
+    """Get the process-wide profiler; only one capture runs at a time."""
+    global _profiler
+    if _profiler is None:
+        _profiler = LoopProfiler(output_dir=os.getenv("PROFILE_DIR", "profiles"))
+    return _profiler
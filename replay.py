@@ -0,0 +1,228 @@
+"""Replay a request log against either shopping assistant using stub upstreams.
+
+Reproduces the arrival pattern recorded in a request log at 1x/10x/100x speed.
+The LLM and MCP agent are replaced by stubs that wait for the recorded upstream
+time and fail where the original request failed, so caching, routing and
+concurrency changes can be compared locally without calling Groq. The
+assistants' own rate-limit and retry delays are compressed by the same speed-up.
+
+Usage:
+    python replay.py request_log.jsonl --assistant chainlit --speed 10
+    python replay.py request_log.jsonl --assistant cli --speed 100 --output replayed.jsonl
+"""
+import argparse
+import asyncio
+import contextvars
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from request_log import read_request_log
+from token_budget import get_token_ledger
+
+# The record being replayed by the current task, read by the stub upstreams
+current_record = contextvars.ContextVar("current_record")
+
+FAILED_ROUTES = ("fallback", "error", "circuit_open")
+
+# Stage holding the upstream call time; older logs used 'llm' (Chainlit) or 'agent' (CLI)
+UPSTREAM_STAGES = ("upstream", "llm", "agent")
+
+
+class StubMessage:
+    """Minimal stand-in for a LangChain AI message."""
+
+    def __init__(self, content: str):
+        self.content = content
+
+
+async def _stub_upstream_call(upstream_scale: float) -> str:
+    """Wait for the recorded upstream time and reproduce the recorded outcome."""
+    record = current_record.get()
+    attempts = max(record.get('attempts') or 1, 1)
+    timings = record.get('timings_ms', {})
+    stage_ms = next((timings[stage] for stage in UPSTREAM_STAGES if stage in timings), 0.0)
+    latency = stage_ms / 1000 / attempts * upstream_scale
+    await asyncio.sleep(latency)
+
+    # Charge the recorded tokens so budgets behave as they did originally
+    get_token_ledger().record("replay-stub", 0, (record.get('tokens') or 0) // attempts, latency)
+
+    if record.get('route') in FAILED_ROUTES:
+        raise RuntimeError(f"Replayed upstream failure for: {record.get('query', '')[:50]}")
+    return f"Replayed answer for: {record.get('query', '')}"
+
+
+class StubLLM:
+    """Replaces ChatGroq in the Chainlit assistant."""
+
+    def __init__(self, upstream_scale: float = 1.0):
+        self.upstream_scale = upstream_scale
+
+    async def ainvoke(self, prompt, **kwargs) -> StubMessage:
+        return StubMessage(await _stub_upstream_call(self.upstream_scale))
+
+
+class StubAgent:
+    """Replaces MCPAgent in the CLI assistant."""
+
+    def __init__(self, upstream_scale: float = 1.0):
+        self.upstream_scale = upstream_scale
+
+    async def run(self, prompt, **kwargs) -> str:
+        return await _stub_upstream_call(self.upstream_scale)
+
+    def clear_conversation_history(self):
+        pass
+
+    def add_to_history(self, message):
+        pass
+
+    def get_conversation_history(self) -> List:
+        return []
+
+
+def build_assistant(kind: str, speed: float, upstream_scale: float, output: Optional[str], index_dir: Optional[str]):
+    """Create an assistant wired to stub upstreams, with its own delays compressed by `speed`."""
+    # The constructors only check that a key is present; no request is made
+    os.environ.setdefault("GROQ_API_KEY", "replay-stub")
+    os.environ["REQUEST_LOG_PATH"] = output or ""
+    # Start from an empty product index unless one is given, so the live index is untouched
+    os.environ["PRODUCT_INDEX_DIR"] = index_dir or tempfile.mkdtemp(prefix="replay_index_")
+
+    if kind == "cli":
+        import app
+        from mcp_selector import MCPServerSelector
+        assistant = app.ShoppingAssistant()
+        # Keep real server selection so replays exercise routing, but never start a server
+        assistant.server_selector = MCPServerSelector.from_config_file("browser_mcp.json")
+        assistant.mcp_servers = assistant.server_selector.server_names()
+        stub_agent = StubAgent(upstream_scale)
+
+        async def get_stub_agent(servers, model_name):
+            return stub_agent
+
+        assistant._get_agent = get_stub_agent
+        assistant.min_search_interval /= speed
+        assistant.retry_delay /= speed
+        return assistant, None
+
+    import shopping_assistant_chainlit as chainlit_app
+    assistant = chainlit_app.ShoppingAssistant()
+    assistant.llm = assistant.cheap_llm = StubLLM(upstream_scale)
+    assistant.min_search_interval /= speed
+    return assistant, chainlit_app
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def discard_update(content: str):
+    """Stands in for the Chainlit renderer so comparisons take the sectioned path."""
+
+
+async def replay(records: List[Dict], kind: str, speed: float, upstream_scale: float,
+                 use_admission: bool, output: Optional[str], index_dir: Optional[str]) -> Dict:
+    """Replay records on their original schedule compressed by `speed`."""
+    assistant, chainlit_app = build_assistant(kind, speed, upstream_scale, output, index_dir)
+
+    first_ts = records[0]['ts']
+    started = time.perf_counter()
+    latencies: List[float] = []
+    outcomes = Counter()
+
+    async def run_one(record: Dict):
+        delay = (record['ts'] - first_ts) / speed - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        current_record.set(record)
+        session_id = record.get('session') or "replay"
+        request_started = time.perf_counter()
+        ticket = None
+        try:
+            if use_admission and chainlit_app:
+                try:
+                    ticket = await chainlit_app.admission_controller.acquire(session_id)
+                except chainlit_app.AdmissionRejected:
+                    outcomes['shed'] += 1
+                    return
+
+            if chainlit_app:
+                await assistant.process_shopping_query(record['query'], session_id, on_update=discard_update)
+            else:
+                await assistant.process_shopping_query(record['query'])
+            outcomes['completed'] += 1
+        finally:
+            if ticket:
+                chainlit_app.admission_controller.release(ticket)
+        latencies.append(time.perf_counter() - request_started)
+
+    await asyncio.gather(*(run_one(record) for record in records))
+
+    return {
+        'requests': len(records),
+        'wall_time': time.perf_counter() - started,
+        'latencies': latencies,
+        'outcomes': outcomes,
+        'recorded_routes': Counter(record.get('route') for record in records),
+        'recorded_cache': Counter(record.get('cache') for record in records)
+    }
+
+
+def print_report(result: Dict, speed: float):
+    latencies = result['latencies']
+    print("\n" + "=" * 60)
+    print(f"📼 Replay finished at {speed:g}x speed")
+    print("=" * 60)
+    print(f"• Requests: {result['requests']} in {result['wall_time']:.1f}s")
+    print(f"• Completed: {result['outcomes']['completed']} | Shed: {result['outcomes']['shed']}")
+    print(f"• Latency p50: {percentile(latencies, 50):.2f}s | p95: {percentile(latencies, 95):.2f}s | "
+          f"p99: {percentile(latencies, 99):.2f}s | max: {max(latencies, default=0):.2f}s")
+    print(f"• Recorded routes: {dict(result['recorded_routes'])}")
+    print(f"• Recorded cache outcomes: {dict(result['recorded_cache'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a shopping assistant request log with stub upstreams.")
+    parser.add_argument("log", help="Request log written by RequestLog (JSON lines)")
+    parser.add_argument("--assistant", choices=["cli", "chainlit"], default="chainlit",
+                        help="Which assistant to drive")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival speed-up, e.g. 1, 10 or 100")
+    parser.add_argument("--upstream-scale", type=float, default=1.0,
+                        help="Multiplier for recorded upstream latency (0 for instant stubs)")
+    parser.add_argument("--admission", action="store_true",
+                        help="Route Chainlit requests through the admission controller")
+    parser.add_argument("--output", help="Write the replayed run to this request log")
+    parser.add_argument("--limit", type=int, help="Only replay the first N records")
+    parser.add_argument("--index-dir", help="Product index to use (default: a fresh temporary one)")
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error("--speed must be greater than 0")
+    if args.admission and args.assistant == "cli":
+        print("⚠️ --admission only applies to the chainlit assistant; the CLI replay runs without it")
+
+    records = [record for record in read_request_log(args.log) if 'ts' in record and 'query' in record]
+    records.sort(key=lambda record: record['ts'])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print(f"❌ No replayable records found in {args.log}")
+        return
+
+    print(f"📼 Replaying {len(records)} requests against the {args.assistant} assistant at {args.speed:g}x...")
+    result = asyncio.run(replay(records, args.assistant, args.speed, args.upstream_scale,
+                                args.admission, args.output, args.index_dir))
+    print_report(result, args.speed)
+
+
+if __name__ == "__main__":
+    main()
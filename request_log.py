@@ -0,0 +1,94 @@
+"""Append-only log of shopping queries for later replay.
+
+Every processed query is written as one compact JSON line holding the query,
+its analysis, the route it took, the cache outcome and per-stage timings.
+`replay.py` reads these logs back to reproduce real traffic locally.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class RequestTrace:
+    """Collects route, cache outcome and stage timings while a query is processed."""
+
+    def __init__(self):
+        self.route = "unknown"
+        self.cache = "none"
+        self.attempts = 0
+        self.upstreams: List[str] = []
+        self.tokens = 0
+        self.timings: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a processing stage; repeated stages accumulate."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+
+class RequestLog:
+    """Writes one JSON line per processed query."""
+
+    def __init__(self, path: Optional[str] = None):
+        # Set REQUEST_LOG_PATH to an empty string to turn logging off
+        self.path = path if path is not None else os.getenv("REQUEST_LOG_PATH", "request_log.jsonl")
+        self._file = None
+
+    def record(self, assistant: str, query: str, analysis: Optional[Dict],
+               trace: RequestTrace, session_id: Optional[str] = None):
+        """Append a record for a finished query."""
+        if not self.path:
+            return
+
+        timings = {stage: round(seconds * 1000, 1) for stage, seconds in trace.timings.items()}
+        timings['total'] = round(trace.elapsed() * 1000, 1)
+
+        entry = {
+            'ts': round(time.time(), 3),
+            'assistant': assistant,
+            'session': session_id,
+            'query': query,
+            'analysis': {key: value for key, value in (analysis or {}).items() if key != 'original_query'},
+            'route': trace.route,
+            'cache': trace.cache,
+            'attempts': trace.attempts,
+            'upstreams': trace.upstreams,
+            'tokens': trace.tokens,
+            'timings_ms': timings
+        }
+
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ Could not write request log: {e}")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def read_request_log(path: str) -> Iterator[Dict]:
+    """Yield the records of a request log, skipping malformed lines."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
@@ -1,14 +1,20 @@
 import chainlit as cl
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 import os
 import asyncio
 import json
-import requests
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 import re
 import time
+from admission import AdmissionController, AdmissionRejected
+from circuit_breaker import CircuitBreakerRegistry
+from comparison import extract_compared_products
+from llm_gateway import get_gateway
+from product_index import get_product_index
+from profiler import get_profiler, parse_profile_command, profiling_enabled
+from token_budget import CACHE_ONLY, DOWNGRADE, FALLBACK, get_token_ledger
+from request_log import RequestLog, RequestTrace
 
 class ShoppingAssistant:
     """Intelligent AI Shopping Assistant with web search and product comparison capabilities."""
@@ -20,14 +26,25 @@ class ShoppingAssistant:
         if not os.getenv("GROQ_API_KEY"):
             raise ValueError("GROQ_API_KEY not found in environment variables.")
         
-        # Initialize LLM directly without MCP for now to avoid context issues
-        self.llm = ChatGroq(
-            model="llama-3.3-70b-versatile",  # Changed to a more stable model
+        # Initialize LLM directly without MCP for now to avoid context issues.
+        # The gateway shares one ChatGroq and connection pool across all chat sessions.
+        self.model_name = "llama-3.3-70b-versatile"  # Changed to a more stable model
+        self.llm = get_gateway().get_llm(
+            self.model_name,
             temperature=0.1,
             max_tokens=1500,
             max_retries=2,
-            request_timeout=30,
-            api_key=os.getenv("GROQ_API_KEY")
+            request_timeout=30
+        )
+        
+        # Cheaper model used once a token budget is nearly spent
+        self.cheap_model_name = "llama-3.1-8b-instant"
+        self.cheap_llm = get_gateway().get_llm(
+            self.cheap_model_name,
+            temperature=0.1,
+            max_tokens=1000,
+            max_retries=1,
+            request_timeout=20
         )
         
         self.conversation_history = []
@@ -44,6 +61,15 @@ class ShoppingAssistant:
             'clothing': ['shirt', 'jeans', 'dress', 'shoes', 'jacket', 'nike', 'adidas'],
             'home': ['furniture', 'decor', 'bedding', 'kitchen', 'bathroom', 'sofa', 'table']
         }
+        
+        # Local semantic index of known topics and recent answers
+        self.product_index = get_product_index()
+        self.product_index.seed_topics(self.product_categories)
+        
+        # Comparison sections are cached per product so "X vs Y" and "X vs Z" share X
+        self.section_ttl = 6 * 3600
+        self.max_cached_sections = 2000
+        self.max_compared_products = 4
 
     async def initialize(self):
         """Initialize the shopping assistant."""
@@ -74,11 +100,19 @@ class ShoppingAssistant:
         
         # Detect product category
         detected_category = 'general'
+        category_source = 'keywords'
         for category, keywords in self.product_categories.items():
             if any(keyword in query_lower for keyword in keywords):
                 detected_category = category
                 break
         
+        # Fall back to the local index for phrasings the keywords don't cover
+        if detected_category == 'general':
+            match = self.product_index.detect_category(query)
+            if match:
+                detected_category = match[0]
+                category_source = 'index'
+        
         # Extract budget
         budget_match = re.search(r'\$?(\d+(?:,\d{3})*(?:\.\d{2})?)', query)
         budget = budget_match.group(1) if budget_match else None
@@ -86,12 +120,22 @@ class ShoppingAssistant:
         return {
             'query_types': query_types,
             'category': detected_category,
+            'category_source': category_source,
             'budget': budget,
             'original_query': query
         }
 
-    async def get_smart_response(self, user_query: str, analysis: Dict) -> str:
+    def _select_llm(self, downgrade: bool = False):
+        """Get the LLM and its model name, switching to the cheaper model when downgraded."""
+        if downgrade:
+            return self.cheap_llm, self.cheap_model_name
+        return self.llm, self.model_name
+
+    async def get_smart_response(self, user_query: str, analysis: Dict, trace: Optional[RequestTrace] = None,
+                                 downgrade: bool = False) -> str:
         """Get intelligent response using LLM with shopping context."""
+        trace = trace or RequestTrace()
+        llm, model_name = self._select_llm(downgrade)
         
         # Build context-aware prompt
         system_context = f"""
@@ -111,16 +155,27 @@ Be specific, practical, and honest. If you don't have current pricing, mention t
 User Query: {user_query}
 """
 
+        # Skip straight to the fallback while the model is known to be down
+        breaker = circuit_breakers.get(f"llm:{model_name}")
+        if not breaker.allow_request():
+            trace.route = "circuit_open"
+            return self.get_fallback_response(user_query, analysis)
+
         try:
             # Rate limiting
             current_time = time.time()
             if current_time - self.last_search_time < self.min_search_interval:
-                await asyncio.sleep(self.min_search_interval - (current_time - self.last_search_time))
+                with trace.stage('rate_limit'):
+                    await asyncio.sleep(self.min_search_interval - (current_time - self.last_search_time))
             
             self.last_search_time = time.time()
             
             # Get response from LLM
-            response = await self.llm.ainvoke(system_context)
+            trace.attempts = 1
+            with trace.stage('upstream'):
+                response = await llm.ainvoke(system_context)
+            breaker.record_success()
+            trace.route = "llm"
             
             # Store in conversation history
             self.conversation_history.append({
@@ -133,7 +188,134 @@ User Query: {user_query}
             return response.content
             
         except Exception as e:
+            breaker.record_failure()
+            trace.route = "fallback"
+            return self.get_fallback_response(user_query, analysis)
+
+    def extract_products(self, query: str) -> List[str]:
+        """Pull the compared products out of a comparison query."""
+        return extract_compared_products(query, self.max_compared_products)
+
+    def _get_cached_section(self, key: str) -> Optional[str]:
+        cached = comparison_sections.get(key)
+        if cached and time.time() - cached[0] <= self.section_ttl:
+            return cached[1]
+        return None
+
+    async def _generate_section(self, key: str, prompt: str, trace: RequestTrace,
+                                downgrade: bool = False, cache_only: bool = False) -> Tuple[str, Optional[str], bool]:
+        """Generate one comparison section, reusing a cached copy when there is one.
+
+        Returns the section key, its markdown (None on failure) and whether it came from the cache.
+        """
+        cached = self._get_cached_section(key)
+        if cached:
+            return key, cached, True
+        if cache_only:
+            return key, None, False
+        
+        llm, model_name = self._select_llm(downgrade)
+        breaker = circuit_breakers.get(f"llm:{model_name}")
+        if not breaker.allow_request():
+            return key, None, False
+        
+        try:
+            trace.attempts += 1
+            with trace.stage('upstream'):
+                response = await llm.ainvoke(prompt)
+            breaker.record_success()
+        except Exception:
+            breaker.record_failure()
+            return key, None, False
+        
+        self._store_section(key, response.content)
+        return key, response.content, False
+
+    def _store_section(self, key: str, content: str):
+        """Cache a finished section, evicting expired entries and then the oldest ones."""
+        now = time.time()
+        comparison_sections.pop(key, None)  # Re-insert so dict order stays oldest first
+        comparison_sections[key] = (now, content)
+        while comparison_sections:
+            oldest_key, (created_at, _) = next(iter(comparison_sections.items()))
+            if now - created_at <= self.section_ttl and len(comparison_sections) <= self.max_cached_sections:
+                break
+            del comparison_sections[oldest_key]
+
+    async def get_comparison_response(self, user_query: str, analysis: Dict, products: List[str],
+                                      on_update: Callable[[str], Awaitable[None]],
+                                      trace: Optional[RequestTrace] = None, downgrade: bool = False,
+                                      cache_only: bool = False) -> str:
+        """Build a comparison from per-product sections and a verdict, generated concurrently.
+
+        `on_update` receives the markdown assembled so far each time a section finishes.
+        """
+        trace = trace or RequestTrace()
+        category = analysis['category']
+        budget = f"${analysis['budget']}" if analysis['budget'] else 'not specified'
+        
+        section_prompts = {}
+        for product in products:
+            key = f"product:{category}:{' '.join(product.lower().split())}"
+            section_prompts[key] = f"""
+You are an expert Shopping Assistant writing one section of a {category} product comparison.
+Write a concise markdown section about **{product}** only, starting with the heading "### {product}".
+Cover key features and specifications, typical price range, pros and cons. Keep it under 250 words.
+If you don't have current pricing, say that prices may vary.
+"""
+        
+        verdict_key = f"verdict:{category}:{budget}:" + "|".join(sorted(' '.join(p.lower().split()) for p in products))
+        section_prompts[verdict_key] = f"""
+You are an expert Shopping Assistant. Give a short verdict comparing {', '.join(products)}.
+Budget mentioned: {budget}
+Start with the heading "### 🏆 Verdict", then say which option suits which kind of buyer and finish with a one-line recommendation.
+Keep it under 150 words.
+
+User Query: {user_query}
+"""
+        
+        titles = {key: product for key, product in zip(section_prompts, products)}
+        titles[verdict_key] = "the verdict"
+        sections: Dict[str, Optional[str]] = {key: None for key in section_prompts}
+        cache_hits = 0
+        failures = 0
+        
+        def assemble() -> str:
+            parts = [f"## ⚖️ {' vs '.join(products)}"]
+            for key, content in sections.items():
+                parts.append(content if content is not None else f"⏳ *Researching {titles[key]}...*")
+            return "\n\n".join(parts)
+        
+        await on_update(assemble())
+        
+        tasks = [self._generate_section(key, prompt, trace, downgrade, cache_only)
+                 for key, prompt in section_prompts.items()]
+        for finished in asyncio.as_completed(tasks):
+            key, content, from_cache = await finished
+            cache_hits += from_cache
+            if not content:
+                failures += 1
+                content = f"⚠️ *Couldn't research {titles[key]} right now - please check retailer sites.*"
+            sections[key] = content
+            await on_update(assemble())
+        
+        if failures == len(sections):
+            trace.route = "fallback"
             return self.get_fallback_response(user_query, analysis)
+        
+        # Partial comparisons contain placeholders, so they must not be stored as answers
+        trace.route = "comparison_partial" if failures else "comparison"
+        trace.cache = "hit" if cache_hits == len(sections) else "partial" if cache_hits else "miss"
+        response = assemble()
+        
+        self.conversation_history.append({
+            'query': user_query,
+            'response': response[:200] + "..." if len(response) > 200 else response,
+            'timestamp': datetime.now().isoformat(),
+            'category': category
+        })
+        
+        return response
 
     def get_fallback_response(self, query: str, analysis: Dict) -> str:
         """Provide fallback response when LLM fails."""
@@ -275,18 +457,74 @@ For comparing electronics, I recommend checking:
 Would you like me to help you with a more specific aspect of your query?
 """
 
-    async def process_shopping_query(self, user_query: str) -> str:
-        """Process shopping queries with improved error handling."""
+    async def process_shopping_query(self, user_query: str, session_id: Optional[str] = None,
+                                     on_update: Optional[Callable[[str], Awaitable[None]]] = None,
+                                     analysis: Optional[Dict] = None) -> str:
+        """Process shopping queries with improved error handling.
+
+        When `on_update` is given, comparisons are rendered section by section through it.
+        Pass `analysis` when the query was already categorised.
+        """
+        trace = RequestTrace()
         try:
             # Analyze the query
-            analysis = self.categorize_query(user_query)
+            if analysis is None:
+                with trace.stage('analyze'):
+                    analysis = self.categorize_query(user_query)
+            
+            # Check token budgets before spending anything on the LLM
+            budget_decision = get_token_ledger().check(session_id, analysis['category'], self.model_name)
+            
+            # Answer locally when an almost identical query was answered recently
+            with trace.stage('index'):
+                cached_answer = self.product_index.lookup_answer(user_query)
+            
+            products = self.extract_products(user_query) if 'comparison' in analysis['query_types'] else []
+            
+            if cached_answer:
+                trace.cache = "hit"
+                trace.route = "index"
+                response = cached_answer[0]
+                self.conversation_history.append({
+                    'query': user_query,
+                    'response': response[:200] + "..." if len(response) > 200 else response,
+                    'timestamp': datetime.now().isoformat(),
+                    'category': analysis['category']
+                })
             
-            # Get intelligent response
-            response = await self.get_smart_response(user_query, analysis)
+            elif budget_decision == CACHE_ONLY and products and on_update:
+                # Over budget: a comparison can still be assembled from cached sections
+                response = await self.get_comparison_response(user_query, analysis, products, on_update,
+                                                              trace, cache_only=True)
             
+            elif budget_decision in (CACHE_ONLY, FALLBACK):
+                trace.cache = "miss"
+                trace.route = "budget_fallback"
+                response = self.get_fallback_response(user_query, analysis)
+            
+            else:
+                trace.cache = "miss"
+                downgrade = budget_decision == DOWNGRADE
+                
+                # Get intelligent response, streaming comparisons one section at a time
+                with get_token_ledger().scope(session_id, analysis['category']) as usage:
+                    if products and on_update:
+                        response = await self.get_comparison_response(user_query, analysis, products, on_update,
+                                                                      trace, downgrade)
+                    else:
+                        response = await self.get_smart_response(user_query, analysis, trace, downgrade)
+                trace.tokens = usage.tokens
+                
+                if trace.route in ("llm", "comparison"):
+                    self.product_index.add(user_query, analysis['category'], answer=response)
+            
+            request_log.record("chainlit", user_query, analysis, trace, session_id)
             return response
             
         except Exception as e:
+            trace.route = "error"
+            request_log.record("chainlit", user_query, analysis, trace, session_id)
+            
             # Return helpful error message
             return f"""
 ❌ **Temporary Issue**: {str(e)}
@@ -329,6 +567,33 @@ Would you like to try a different question?
 # Initialize global assistant
 shopping_assistant = None
 
+# Shared across all chat sessions: bounds concurrent LLM work and sheds excess load
+admission_controller = AdmissionController(max_concurrent=4, max_queue=32, queue_slo=20.0)
+
+# Shared across all chat sessions so an outage trips the breaker once for everyone
+circuit_breakers = CircuitBreakerRegistry(failure_threshold=0.5, window_size=10, min_calls=3, open_duration=60.0)
+
+# Append-only log of processed queries, replayable with replay.py
+request_log = RequestLog()
+
+# Finished comparison sections shared across sessions: key -> (created_at, markdown)
+comparison_sections: Dict[str, Tuple[float, str]] = {}
+
+# Background `profile` capture, kept referenced so it isn't garbage collected
+profile_task: Optional[asyncio.Task] = None
+
+async def capture_profile(duration: float):
+    """Capture an event-loop profile and post the summary and flame graph to the chat."""
+    try:
+        report = await get_profiler().capture(duration)
+        await cl.Message(
+            content=f"🔬 {report.summary}\nOpen the attached file at https://www.speedscope.app",
+            author="System",
+            elements=[cl.File(name=os.path.basename(report.speedscope_path), path=report.speedscope_path, display="inline")]
+        ).send()
+    except Exception as e:
+        await cl.Message(content=f"❌ Profile capture failed: {e}", author="System").send()
+
 @cl.on_chat_start
 async def start():
     """Initialize the shopping assistant when chat starts."""
@@ -358,6 +623,7 @@ I'm here to help you make informed shopping decisions with:
 - Type **`help`** - Show available commands
 - Type **`clear`** - Clear conversation history
 - Type **`stats`** - Show conversation statistics
+- Type **`status`** - Show upstream health
 
 *Ready to help you shop smarter! What are you looking for today?*
 """
@@ -388,7 +654,7 @@ I'm here to help you make informed shopping decisions with:
 @cl.on_message
 async def main(message: cl.Message):
     """Handle incoming messages."""
-    global shopping_assistant
+    global shopping_assistant, profile_task
     
     if not shopping_assistant:
         await cl.Message(
@@ -410,12 +676,33 @@ async def main(message: cl.Message):
     
     if user_query.lower() == "stats":
         stats = shopping_assistant.get_stats()
+        stats += "\n" + admission_controller.get_stats()
+        stats += "\n" + get_gateway().get_stats()
+        stats += "\n" + get_token_ledger().get_stats()
         await cl.Message(
             content=f"📊 {stats}",
             author="System"
         ).send()
         return
     
+    if user_query.lower() == "status":
+        await cl.Message(
+            content=f"📊 **Upstream Status:**\n{circuit_breakers.get_status()}",
+            author="System"
+        ).send()
+        return
+    
+    profile_duration = parse_profile_command(user_query) if profiling_enabled() else None
+    if profile_duration is not None:
+        if get_profiler().running:
+            content = "🔬 A profile is already being captured."
+        else:
+            # Profiles the whole server, so concurrent sessions show up too
+            profile_task = asyncio.create_task(capture_profile(profile_duration))
+            content = f"🔬 Profiling the event loop for {profile_duration:.0f}s. The flame graph will be posted here."
+        await cl.Message(content=content, author="System").send()
+        return
+    
     if user_query.lower() == "help":
         help_message = """
 ## 🛍️ Shopping Assistant Help
@@ -436,7 +723,9 @@ async def main(message: cl.Message):
 ### 🎮 **Commands:**
 - **`clear`** - Clear conversation history
 - **`stats`** - Show conversation statistics  
+- **`status`** - Show upstream health  
 - **`help`** - Show this help message
+- **`profile 30s`** - Capture an event-loop profile (needs `ENABLE_PROFILING=1`)
 
 ### 💡 **Tips for Better Results:**
 - Be specific about your needs and budget
@@ -452,36 +741,80 @@ async def main(message: cl.Message):
         ).send()
         return
     
-    # Process shopping query with visual feedback
-    async with cl.Step(name="🔍 Analyzing your shopping query", type="tool") as step:
+    # Wait for a processing slot, showing the user where they are in the queue
+    session_id = cl.context.session.id
+    ticket = None
+    rejection = None
+    async with cl.Step(name="⏳ Waiting for a free assistant", type="tool") as step:
+        async def show_queue_position(position: int, expected_wait: float):
+            step.output = f"You are #{position} in the queue (about {expected_wait:.0f}s wait)"
+            await step.update()
+
         try:
-            # Analyze query first
-            analysis = shopping_assistant.categorize_query(user_query)
-            step.output = f"Detected: {analysis['category']} - {', '.join(analysis['query_types']) if analysis['query_types'] else 'general inquiry'}"
+            ticket = await admission_controller.acquire(session_id, on_position=show_queue_position)
+            step.output = "Slot acquired, processing your query"
+        except AdmissionRejected as e:
+            rejection = e
+            step.output = f"Request shed: {e.reason}"
+
+    if rejection:
+        await cl.Message(
+            content=f"🚦 **The assistant is very busy right now.** Please try again in about {max(rejection.retry_after, 1):.0f} seconds.",
+            author="System"
+        ).send()
+        return
+
+    try:
+        # Process shopping query with visual feedback
+        analysis = None  # Handed to process_shopping_query so the query is only categorised once
+        async with cl.Step(name="🔍 Analyzing your shopping query", type="tool") as step:
+            try:
+                # Analyze query first
+                analysis = shopping_assistant.categorize_query(user_query)
+                step.output = f"Detected: {analysis['category']} - {', '.join(analysis['query_types']) if analysis['query_types'] else 'general inquiry'}"
             
-        except Exception as e:
-            step.output = f"Analysis error: {str(e)}"
+            except Exception as e:
+                step.output = f"Analysis error: {str(e)}"
     
-    # Get and send response
-    async with cl.Step(name="🤖 Generating shopping advice", type="llm") as step:
-        try:
-            response = await shopping_assistant.process_shopping_query(user_query)
-            step.output = "Generated personalized shopping advice"
+        # Comparisons render into this message section by section as they finish
+        response_message = cl.Message(content="", author="Shopping Assistant")
+        message_sent = False
+
+        async def render_partial(content: str):
+            nonlocal message_sent
+            response_message.content = content
+            if message_sent:
+                await response_message.update()
+            else:
+                await response_message.send()
+                message_sent = True
+
+        # Get and send response
+        async with cl.Step(name="🤖 Generating shopping advice", type="llm") as step:
+            try:
+                response = await shopping_assistant.process_shopping_query(
+                    user_query, session_id, on_update=render_partial, analysis=analysis)
+                step.output = "Generated personalized shopping advice"
             
-        except Exception as e:
-            step.output = f"Error: {str(e)}"
-            response = f"❌ Sorry, I encountered an error: {str(e)}\n\nPlease try rephrasing your question or ask something else."
+            except Exception as e:
+                step.output = f"Error: {str(e)}"
+                response = f"❌ Sorry, I encountered an error: {str(e)}\n\nPlease try rephrasing your question or ask something else."
     
-    # Send the response
-    await cl.Message(
-        content=response,
-        author="Shopping Assistant"
-    ).send()
+        # Send the response
+        response_message.content = response
+        if message_sent:
+            await response_message.update()
+        else:
+            await response_message.send()
+
+    finally:
+        admission_controller.release(ticket)
 
 @cl.on_chat_end
 async def end():
     """Cleanup when chat ends."""
     global shopping_assistant
+    get_token_ledger().forget_session(cl.context.session.id)
     if shopping_assistant:
         shopping_assistant.clear_history()
         print("Chat session ended and cleaned up.")
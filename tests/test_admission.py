@@ -0,0 +1,92 @@
+"""Tests for the Chainlit admission queue."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from admission import AdmissionController, AdmissionRejected  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_admits_up_to_max_concurrent_then_queues_in_order():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_slo=60.0)
+        first = await controller.acquire("a")
+        positions = []
+
+        async def on_position(position, expected_wait):
+            positions.append(position)
+
+        second = asyncio.create_task(controller.acquire("b", on_position=on_position))
+        third = asyncio.create_task(controller.acquire("c"))
+        await asyncio.sleep(0)
+        assert not second.done() and not third.done()
+        assert positions == [1]
+
+        controller.release(first)
+        ticket = await second
+        assert ticket.session_id == "b"
+        assert not third.done()
+        controller.release(ticket)
+        controller.release(await third)
+
+    run(scenario())
+
+
+def test_session_waits_for_its_own_running_query():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, initial_service_time=5.0)
+        running = await controller.acquire("a")
+        waits = []
+
+        async def on_position(position, expected_wait):
+            waits.append(expected_wait)
+
+        queued = asyncio.create_task(controller.acquire("a", on_position=on_position))
+        await asyncio.sleep(0)
+        assert not queued.done()
+        # Slots are free, but the session's own query is still expected to take ~5s
+        assert waits and waits[0] == pytest.approx(5.0, abs=0.5)
+
+        controller.release(running)
+        controller.release(await queued)
+
+    run(scenario())
+
+
+def test_sheds_when_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_slo=60.0)
+        running = await controller.acquire("a")
+        queued = asyncio.create_task(controller.acquire("b"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("c")
+        assert rejected.value.reason == "queue is full"
+        assert controller.shed == 1
+
+        controller.release(running)
+        controller.release(await queued)
+
+    run(scenario())
+
+
+def test_sheds_when_expected_wait_exceeds_slo():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_slo=2.0, initial_service_time=5.0)
+        running = await controller.acquire("a")
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("b")
+        assert rejected.value.reason == "expected wait exceeds SLO"
+        assert rejected.value.retry_after == pytest.approx(5.0)
+
+        controller.release(running)
+
+    run(scenario())
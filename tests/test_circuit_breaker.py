@@ -0,0 +1,60 @@
+"""Tests for the per-upstream circuit breakers."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from circuit_breaker import CircuitBreaker, CircuitBreakerRegistry  # noqa: E402
+
+
+def test_opens_once_failure_rate_reaches_threshold():
+    breaker = CircuitBreaker("llm:test", failure_threshold=0.5, window_size=10, min_calls=3, open_duration=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED  # Too few calls to judge yet
+
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.retry_after() > 0
+
+
+def test_stays_closed_below_threshold():
+    breaker = CircuitBreaker("llm:test", failure_threshold=0.5, min_calls=3)
+    for _ in range(3):
+        breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_half_open_probe_success_closes():
+    breaker = CircuitBreaker("mcp:test", min_calls=1, open_duration=60.0, half_open_probes=1)
+    breaker.record_failure()
+    breaker._opened_at -= 60.0  # Let the cool-down expire
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # Only one probe at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failure_rate == 0.0
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = CircuitBreaker("mcp:test", min_calls=1, open_duration=60.0)
+    breaker.record_failure()
+    breaker._opened_at -= 60.0  # Let the cool-down expire
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+
+
+def test_registry_shares_one_breaker_per_name():
+    registry = CircuitBreakerRegistry(min_calls=1)
+    assert registry.get("llm:a") is registry.get("llm:a")
+    registry.get("llm:a").record_failure()
+    assert registry.get("llm:a").is_open()
+    assert not registry.get("llm:b").is_open()
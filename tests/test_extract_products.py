@@ -0,0 +1,38 @@
+"""Tests for pulling compared products out of comparison queries."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from comparison import extract_compared_products  # noqa: E402
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Compare iPhone 15 vs Samsung Galaxy S24", ["iPhone 15", "Samsung Galaxy S24"]),
+    ("Sony WH-1000XM5 vs Bose QuietComfort 45", ["Sony WH-1000XM5", "Bose QuietComfort 45"]),
+    ("Netflix vs Amazon Prime comparison", ["Netflix", "Amazon Prime"]),
+    ("Compare Netflix and Amazon Prime in terms of content and pricing", ["Netflix", "Amazon Prime"]),
+    ("Difference between iPhone 15 and Samsung S24", ["iPhone 15", "Samsung S24"]),
+    ("What is the difference between OLED and QLED?", ["OLED", "QLED"]),
+    ("Which is better for gaming, PS5 or Xbox Series X?", ["PS5", "Xbox Series X"]),
+    ("Which is better: Kindle, Kobo or Nook?", ["Kindle", "Kobo", "Nook"]),
+    ("Should I buy the Pixel 8 or iPhone 15?", ["Pixel 8", "iPhone 15"]),
+    ("iPhone 15 vs Pixel 8: which one is better?", ["iPhone 15", "Pixel 8"]),
+])
+def test_extracts_compared_products(query, expected):
+    assert extract_compared_products(query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "Is a dishwasher better than hand washing and drying?",
+    "Which phone has a better camera, black or white?",
+    "Best laptop for programming under $1000",
+    "Tell me about washing machines and dryers",
+])
+def test_ignores_queries_without_a_product_list(query):
+    assert extract_compared_products(query) == []
+
+
+def test_rejects_too_many_products():
+    assert extract_compared_products("Compare A1, B2, C3, D4 and E5", max_products=4) == []
@@ -0,0 +1,48 @@
+"""Tests for per-query MCP server selection."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from mcp_selector import MCPServerSelector  # noqa: E402
+
+CONFIG = {
+    'mcpServers': {
+        'playwright': {'command': "npx", 'capabilities': ["browser", "page_content", "web_search"], 'cost': 5},
+        'airbnb': {'command': "npx", 'capabilities': ["lodging"], 'cost': 2},
+        'duckduckgo-search': {'command': "npx", 'capabilities': ["web_search"], 'cost': 1},
+    }
+}
+
+
+def test_plain_queries_use_the_cheapest_search_server():
+    selector = MCPServerSelector(CONFIG)
+    assert selector.select({'category': 'electronics', 'query_types': ['recommendation']}) == ('duckduckgo-search',)
+
+
+def test_price_queries_pick_the_minimum_cost_cover():
+    # Greedy cost-per-capability would take duckduckgo-search first and end at cost 6
+    selector = MCPServerSelector(CONFIG)
+    assert selector.select({'category': 'electronics', 'query_types': ['price']}) == ('playwright',)
+
+
+def test_travel_queries_add_lodging():
+    selector = MCPServerSelector(CONFIG)
+    assert selector.select({'category': 'travel', 'query_types': []}) == ('airbnb', 'duckduckgo-search')
+
+
+def test_excluded_servers_are_routed_around():
+    selector = MCPServerSelector(CONFIG)
+    analysis = {'category': 'electronics', 'query_types': ['price']}
+    # Nothing else offers page_content, so the best partial cover is used
+    assert selector.select(analysis, exclude=['playwright']) == ('duckduckgo-search',)
+    assert selector.select(analysis, exclude=['playwright', 'duckduckgo-search']) == ()
+
+
+def test_servers_without_a_profile_count_as_web_search():
+    selector = MCPServerSelector({'mcpServers': {'search': {'command': "npx"}}})
+    assert selector.select({'query_types': []}) == ('search',)
+
+
+def test_client_config_strips_selector_keys():
+    selector = MCPServerSelector(CONFIG)
+    assert selector.client_config(['airbnb']) == {'mcpServers': {'airbnb': {'command': "npx"}}}
@@ -0,0 +1,231 @@
+"""Token and latency accounting for Groq calls, with budget enforcement.
+
+Every LLM call made through the gateway reports its token usage and latency
+to the process-wide `TokenLedger`, which attributes it to the session and
+category of the query being processed and to the model. Budgets on those
+totals decide whether the next query runs normally, on a cheaper model, from
+the local cache only, or straight from the fallback response.
+"""
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# Budget decisions, from cheapest to most restrictive
+ALLOW = "allow"
+DOWNGRADE = "downgrade"
+CACHE_ONLY = "cache_only"
+FALLBACK = "fallback"
+
+# Rolling windows for the category and model budgets, in seconds
+CATEGORY_WINDOW = 3600
+MODEL_WINDOW = 60
+
+
+@dataclass
+class Usage:
+    """Aggregated usage for one session, category or model."""
+    calls: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class UsageScope:
+    """Who the LLM calls of the current query are charged to."""
+    session_id: str
+    category: str
+    tokens: int = 0
+
+
+_current_scope: contextvars.ContextVar = contextvars.ContextVar("token_usage_scope", default=None)
+
+
+class TokenLedger:
+    """Aggregates token usage per session, category and model and enforces budgets."""
+
+    def __init__(self, session_budget: int = 0, category_hourly_budget: int = 0,
+                 model_tpm_budget: int = 0, downgrade_at: float = 0.7, cache_only_at: float = 0.9):
+        # A budget of 0 disables that check
+        self.session_budget = session_budget
+        self.category_hourly_budget = category_hourly_budget
+        self.model_tpm_budget = model_tpm_budget  # Tokens per minute, like Groq's own rate limits
+        self.downgrade_at = downgrade_at
+        self.cache_only_at = cache_only_at
+
+        self.sessions: Dict[str, Usage] = {}
+        self.categories: Dict[str, Usage] = {}
+        self.models: Dict[str, Usage] = {}
+
+        # (timestamp, tokens) events for the rolling windows
+        self._category_events: Dict[str, Deque[Tuple[float, int]]] = {}
+        self._model_events: Dict[str, Deque[Tuple[float, int]]] = {}
+
+        self.decisions: Dict[str, int] = {}
+        self.handler = TokenAccountingHandler(self)
+
+    @contextmanager
+    def scope(self, session_id: Optional[str], category: str):
+        """Charge LLM calls made inside this block to a session and category."""
+        usage_scope = UsageScope(session_id or "default", category)
+        token = _current_scope.set(usage_scope)
+        try:
+            yield usage_scope
+        finally:
+            _current_scope.reset(token)
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int,
+               latency: float, error: bool = False):
+        """Record one LLM call against the current scope and the model."""
+        scope = _current_scope.get()
+        session_id, category = (scope.session_id, scope.category) if scope else ("unscoped", "unscoped")
+        tokens = prompt_tokens + completion_tokens
+        if scope:
+            scope.tokens += tokens
+
+        for table, key in ((self.sessions, session_id), (self.categories, category), (self.models, model)):
+            usage = table.setdefault(key, Usage())
+            usage.calls += 1
+            usage.errors += error
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+            usage.latency += latency
+
+        now = time.time()
+        for events, key, window in ((self._category_events, category, CATEGORY_WINDOW),
+                                    (self._model_events, model, MODEL_WINDOW)):
+            queue = events.setdefault(key, deque())
+            queue.append((now, tokens))
+            while queue[0][0] < now - window:
+                queue.popleft()
+
+    def forget_session(self, session_id: Optional[str]):
+        """Drop a finished session's usage so per-session totals don't accumulate forever."""
+        self.sessions.pop(session_id or "default", None)
+
+    @staticmethod
+    def _window_total(events: Optional[Deque[Tuple[float, int]]], window: float) -> int:
+        if not events:
+            return 0
+        cutoff = time.time() - window
+        while events and events[0][0] < cutoff:
+            events.popleft()
+        return sum(tokens for _, tokens in events)
+
+    def utilization(self, session_id: Optional[str], category: str, model: str) -> float:
+        """Highest fraction of any applicable budget already used."""
+        ratios = [0.0]
+        if self.session_budget:
+            usage = self.sessions.get(session_id or "default")
+            ratios.append((usage.total_tokens if usage else 0) / self.session_budget)
+        if self.category_hourly_budget:
+            used = self._window_total(self._category_events.get(category), CATEGORY_WINDOW)
+            ratios.append(used / self.category_hourly_budget)
+        if self.model_tpm_budget:
+            used = self._window_total(self._model_events.get(model), MODEL_WINDOW)
+            ratios.append(used / self.model_tpm_budget)
+        return max(ratios)
+
+    def check(self, session_id: Optional[str], category: str, model: str) -> str:
+        """Decide how the next query may use the LLM."""
+        used = self.utilization(session_id, category, model)
+        if used >= 1.0:
+            decision = FALLBACK
+        elif used >= self.cache_only_at:
+            decision = CACHE_ONLY
+        elif used >= self.downgrade_at:
+            decision = DOWNGRADE
+        else:
+            decision = ALLOW
+
+        if decision != ALLOW:
+            print(f"💸 Token budget at {used:.0%} for session {session_id}, category {category}: {decision}")
+        self.decisions[decision] = self.decisions.get(decision, 0) + 1
+        return decision
+
+    def get_stats(self) -> str:
+        """Get token usage statistics."""
+        if not self.models:
+            return "**Token Usage:** no LLM calls yet.\n"
+
+        stats = "**Token Usage:**\n"
+        for title, table in (("Model", self.models), ("Category", self.categories), ("Session", self.sessions)):
+            for key, usage in sorted(table.items(), key=lambda item: item[1].total_tokens, reverse=True)[:5]:
+                avg_latency = usage.latency / usage.calls if usage.calls else 0.0
+                stats += (f"• {title} {key}: {usage.total_tokens} tokens "
+                          f"({usage.prompt_tokens} in / {usage.completion_tokens} out), "
+                          f"{usage.calls} calls, {avg_latency:.1f}s avg\n")
+        if self.decisions:
+            stats += f"• Budget decisions: {self.decisions}\n"
+        return stats
+
+
+class TokenAccountingHandler(BaseCallbackHandler):
+    """LangChain callback that reports each LLM call to the ledger."""
+
+    # Run in the caller's context so the usage scope is visible
+    run_inline = True
+
+    def __init__(self, ledger: TokenLedger):
+        self.ledger = ledger
+        self._started: Dict[UUID, Tuple[float, str]] = {}
+
+    def _start(self, run_id: UUID, invocation_params: Optional[Dict] = None):
+        params = invocation_params or {}
+        model = params.get('model') or params.get('model_name') or "unknown"
+        self._started[run_id] = (time.perf_counter(), model)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._start(run_id, kwargs.get('invocation_params'))
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._start(run_id, kwargs.get('invocation_params'))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        started, model = self._started.pop(run_id, (time.perf_counter(), "unknown"))
+        llm_output = response.llm_output or {}
+        usage = llm_output.get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+
+        # Streaming responses carry usage on the message instead
+        if not usage and response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], 'message', None)
+            metadata = getattr(message, 'usage_metadata', None) or {}
+            prompt_tokens = metadata.get('input_tokens', 0)
+            completion_tokens = metadata.get('output_tokens', 0)
+
+        self.ledger.record(llm_output.get('model_name', model), prompt_tokens, completion_tokens,
+                           time.perf_counter() - started)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        started, model = self._started.pop(run_id, (time.perf_counter(), "unknown"))
+        self.ledger.record(model, 0, 0, time.perf_counter() - started, error=True)
+
+
+_token_ledger: Optional[TokenLedger] = None
+
+
+def get_token_ledger() -> TokenLedger:
+    """Get the process-wide ledger, with budgets from the environment on first use."""
+    global _token_ledger
+    if _token_ledger is None:
+        _token_ledger = TokenLedger(
+            session_budget=int(os.getenv("TOKEN_BUDGET_SESSION", "0")),
+            category_hourly_budget=int(os.getenv("TOKEN_BUDGET_CATEGORY_HOURLY", "0")),
+            model_tpm_budget=int(os.getenv("TOKEN_BUDGET_MODEL_TPM", "0"))
+        )
+    return _token_ledger